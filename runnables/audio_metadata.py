@@ -660,5 +660,655 @@ print(*convert_track(track, adaptor), sep='\n')
 # It's still procedural code but it's nicely composable. And it's quick. In this particular instance, it's faster than os.walk but I've always thought benchmarks are useless without a greater context -- so for shits and giggles, I ran both over my Music directory (with all 26,000+ files), just spitting values into 0 length deque, and my walk function took about ~560ms, os.walk took ~350ms. Considering we're doing a little more work than os.walk, I'll take it any day of the week.
 # 
 # And even though convert_track only accepts one track now, chunking over walk with `islice` is obvious.
+
+# Walking Faster
+# --------------
+# That was a while ago, and since then Python 3.5 grew `os.scandir` -- which is what `os.walk` itself is built on now. `os.listdir` hands back bare names, so `walk` has to ask the filesystem about every single entry again: `ignore` calls `isfile` on it, then `walk` calls `isdir` on it, two `stat`s per file on top of the listing. `scandir` hands back `DirEntry` objects instead, and on most systems the directory listing already says whether each entry is a file or a directory, so `entry.is_dir()` doesn't go back to the disk at all. On a local SSD that's the difference between slow and fast. On a NAS, where every one of those `stat`s is a trip over the network, it's the difference between minutes and seconds.
+# 
+# So `scan` is `walk` rebuilt around that:
+# 
+# * `ignore` gets the `DirEntry` itself, so it can look at the name and ask `is_dir()` for free. `skip_entry` is the old `ignore` written that way.
+# * Ignored directories are dropped before anything is done with them, so a `.thumbnails` folder with thousands of files in it never gets listed.
+# * No recursion: the directories still to visit go on a stack, so a deep library can't hit the recursion limit.
+# * Symlinked directories aren't followed, the same as `os.walk`'s default, so a link back up the tree can't send it round in circles. A directory that can't be read is skipped rather than ending the whole scan.
+# * Paths are yielded as each directory is read, nothing's collected into a big list.
+# * `workers=n` hands directories out to a thread pool instead. Listing a directory is almost all waiting on the filesystem, and threads are fine for waiting, so on a network share several directories can be in flight at once. The catch is that paths come out in whatever order the directories finish.
+# 
+# The order within a directory is whatever the filesystem gives back, not sorted like `walk` was -- sort the output if you need it sorted, most of the time you just need everything once. And since I can't hand over my music directory, here's a made up one: 40 artists, 5 albums each, 12 tracks per album, a cover image in every album and a hidden folder full of thumbnails per artist. It's in a temporary directory that sticks around for the next few sections and gets cleaned up once they're done with it.
+
+# In[8]:
+
+import shutil
+import tempfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+def skip_entry(entry, valid_types=('.mp3', '.ogg', '.oga', '.wav', '.flac')):
+    '''ignore, but for DirEntry objects. is_dir comes from the listing, no extra stat.'''
+    if entry.name.startswith('.'):
+        return True
+    return not entry.is_dir(follow_symlinks=False) and not entry.name.lower().endswith(valid_types)
+
+def _scan_dir(dirpath, ignore):
+    '''Read one directory: the files to yield and the directories to visit.'''
+    files, dirs = [], []
+    try:
+        with os.scandir(dirpath) as entries:
+            for entry in entries:
+                if ignore and ignore(entry):
+                    continue
+                elif entry.is_dir(follow_symlinks=False):
+                    dirs.append(entry.path)
+                else:
+                    files.append(entry)
+    except OSError:
+        # unreadable, gone since it was listed, or the share hiccupped;
+        # os.walk skips these too
+        pass
+    return files, dirs
+
+def scan(basedir, ignore=skip_entry, workers=None, entries=False):
+    '''Yield the path of every file under basedir that ignore doesn't reject.
+    With entries, yield the DirEntry objects themselves.
+    '''
+    if not entries:
+        yield from (e.path for e in scan(basedir, ignore, workers, entries=True))
+        return
+
+    if not workers:
+        stack = [basedir]
+        while stack:
+            files, dirs = _scan_dir(stack.pop(), ignore)
+            yield from files
+            stack.extend(dirs)
+        return
+
+    pool = ThreadPoolExecutor(workers)
+    pending = {pool.submit(_scan_dir, basedir, ignore)}
+    try:
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                files, dirs = future.result()
+                pending.update(pool.submit(_scan_dir, d, ignore) for d in dirs)
+                yield from files
+    finally:
+        # if we're abandoned halfway, don't go on reading the whole library
+        for future in pending:
+            future.cancel()
+        pool.shutdown()
+
+def make_library(root, artists=40, albums=5, tracks=12, thumbnails=50):
+    '''Empty files laid out like a music directory.'''
+    for a in range(artists):
+        artist = path.join(root, 'Artist {}'.format(a))
+        os.makedirs(path.join(artist, '.thumbnails'))
+        for t in range(thumbnails):
+            open(path.join(artist, '.thumbnails', '{}.jpg'.format(t)), 'w').close()
+        for b in range(albums):
+            album = path.join(artist, 'Album {}'.format(b))
+            os.makedirs(album)
+            open(path.join(album, 'cover.jpg'), 'w').close()
+            for t in range(tracks):
+                open(path.join(album, '{:02} Track.mp3'.format(t + 1)), 'w').close()
+
+library = tempfile.mkdtemp()
+make_library(library)
+
+assert sorted(scan(library)) == sorted(scan(library, workers=4)) == list(walk(library, ignore=ignore))
+print(len(list(scan(library))), 'tracks')
+
+get_ipython().magic('timeit -n 10 -r 5 deque(walk(library, ignore=ignore), 0)')
+get_ipython().magic('timeit -n 10 -r 5 deque(scan(library), 0)')
+get_ipython().magic('timeit -n 10 -r 5 deque(scan(library, workers=4), 0)')
+
+
+# Out[8]:
+
+#     2400 tracks
+#     10 loops, best of 5: 23.3 ms per loop
+#     10 loops, best of 5: 6.47 ms per loop
+#     10 loops, best of 5: 8.38 ms per loop
+# 
+
+# Same 2400 tracks out of all three, and `scan` gets there in between a quarter and a third of the time. The thread pool is *slower* here, and that's the honest result: this directory is sitting in memory on a one core machine, so there's no waiting for threads to overlap and all that's left is the overhead of handing work around. Point it at a directory where each listing takes milliseconds, like a share on a NAS, and that's when the workers pay for themselves.
+
+# Only Reading What Changed
+# -------------------------
+# Even with a fast walk, every run still opens every file and reads its tags all over again, and that's where the time really goes -- the walk only reads directories, the tags need a read from every file. Most nights, almost nothing in a music library has changed.
+# 
+# So keep a manifest: for every path, the `(mtime_ns, size, inode)` it had when we last read it, and the fixed up tags we got out of it. On a rescan, a file whose three numbers still match gets skipped without being opened. Anything new or different gets read again, and anything in the manifest that the walk didn't turn up is gone. What comes out is a stream of `Delta`s -- `add`, `update` or `delete`, with the path and the tags -- so whatever's keeping the Artist/Album/Track models (or a database) up to date only has to deal with what changed.
+# 
+# A couple of details:
+# 
+# * Getting those three numbers is one `stat` per file (the inode comes free with the `DirEntry`). That's the cost of a rescan now: a walk and a `stat` each, no reads.
+# * The stored tags are plain namespaces with the same attributes as a fixed `TinyTag` (well, the ones `adaptor` cares about), so `convert_track` takes them as is.
+# * Deletes only come from under the directory being rescanned, so one manifest can cover several roots.
+# * A file that can't be read comes out as an `error` delta with the exception where the tags would be, the same way `extract` below hands errors back. The manifest keeps what it had for that path, so it's read again on the next rescan rather than quietly skipped or reported as deleted. One that disappears between the listing and its `stat` is treated as never having been listed.
+# * Nothing is written until `save`, which writes to a temporary file and then renames it over the old one, so a crash halfway through a save can't leave a half written manifest. Deletes are found after the walk finishes, so run through all the deltas before saving.
+# 
+# The made up library's files are empty, so instead of `TinyTag` the demo reads "tags" out of the path -- and counts how many times it's asked to.
+
+# In[9]:
+
+import json
+import time
+from collections import Counter
+from types import SimpleNamespace
+
+Delta = namedtuple('Delta', ['op', 'path', 'tags'])
+
+def read_tags(fp, fields=('artist', 'album', 'title', 'track', 'year', 'track_total', 'duration')):
+    '''TinyTag and fix_track, cut down to the fields we keep.'''
+    track = fix_track(TinyTag.get(fp))
+    return {f: getattr(track, f) for f in fields}
+
+class Manifest(object):
+    '''Remembers what every file looked like the last time its tags were read.'''
+    def __init__(self, filename, read=read_tags):
+        self.filename = filename
+        self.read = read
+        self.entries = {}
+        if path.exists(filename):
+            with open(filename) as fh:
+                self.entries = json.load(fh)
+
+    def rescan(self, basedir, ignore=skip_entry, workers=None):
+        '''Yield a Delta for everything that changed under basedir since the last rescan.'''
+        seen = set()
+        for entry in scan(basedir, ignore, workers, entries=True):
+            try:
+                st = entry.stat()
+                stamp = [st.st_mtime_ns, st.st_size, entry.inode()]
+            except OSError:
+                # gone since it was listed, so it's a delete if it's anything
+                continue
+            seen.add(entry.path)
+            old = self.entries.get(entry.path)
+            if old is not None and old['stamp'] == stamp:
+                continue
+            try:
+                tags = self.read(entry.path)
+            except Exception as e:
+                # keep whatever we had, so it's tried again next time
+                yield Delta('error', entry.path, e)
+                continue
+            self.entries[entry.path] = {'stamp': stamp, 'tags': tags}
+            yield Delta('update' if old else 'add', entry.path, SimpleNamespace(**tags))
+
+        root = path.join(basedir, '')
+        for fp in [fp for fp in self.entries if fp.startswith(root) and fp not in seen]:
+            yield Delta('delete', fp, SimpleNamespace(**self.entries.pop(fp)['tags']))
+
+    def tracks(self):
+        '''The tags of everything in the manifest.'''
+        return (SimpleNamespace(**e['tags']) for e in self.entries.values())
+
+    def save(self):
+        tmp = self.filename + '.tmp'
+        with open(tmp, 'w') as fh:
+            json.dump(self.entries, fh)
+        os.replace(tmp, self.filename)
+
+reads = 0
+
+def path_tags(fp):
+    '''Stand in for read_tags: ".../Artist 3/Album 1/07 Track.mp3" has all we need.'''
+    global reads
+    reads += 1
+    artist, album, name = fp.split(os.sep)[-3:]
+    return {'artist': artist, 'album': album, 'title': name[3:-4], 'track': int(name[:2]),
+            'year': None, 'track_total': 12, 'duration': 180}
+
+def rescan(manifest):
+    global reads
+    reads = 0
+    start = time.perf_counter()
+    deltas = list(manifest.rescan(library))
+    took = time.perf_counter() - start
+    manifest.save()
+    ops = Counter(d.op for d in deltas)
+    print('{} reads, {} in {:.1f}ms'.format(reads, dict(ops), took * 1000))
+    return deltas
+
+manifest_file = path.join(tempfile.mkdtemp(), 'manifest.json')
+rescan(Manifest(manifest_file, read=path_tags))
+
+# a new process, as far as the manifest is concerned
+manifest = Manifest(manifest_file, read=path_tags)
+rescan(manifest)
+
+album = path.join(library, 'Artist 3', 'Album 1')
+with open(path.join(album, '07 Track.mp3'), 'w') as fh:
+    fh.write('retagged')
+os.remove(path.join(album, '12 Track.mp3'))
+open(path.join(album, '13 Track.mp3'), 'w').close()
+
+for delta in rescan(manifest):
+    print(delta.op, path.relpath(delta.path, library), delta.tags.title)
+
+print(convert_track(next(manifest.tracks()), adaptor)[2])
+shutil.rmtree(path.dirname(manifest_file))
+
+
+# Out[9]:
+
+#     2400 reads, {'add': 2400} in 29.4ms
+#     0 reads, {} in 20.0ms
+#     2 reads, {'update': 1, 'add': 1, 'delete': 1} in 20.3ms
+#     update Artist 3/Album 1/07 Track.mp3 Track
+#     add Artist 3/Album 1/13 Track.mp3 Track
+#     delete Artist 3/Album 1/12 Track.mp3 Track
+#     <Track artist=Artist 13 album=Album 1 track=5 name=Track id=1>
+# 
+
+# The times flatter the first run, since "reading" a track here is splitting a string. With `TinyTag`, every one of those 2400 reads opens a file and parses its header, and that's the part the second run doesn't do at all -- a loaded manifest and nothing changed means a walk and 2400 `stat`s, and that's it. Change three files and three deltas come out, two of them needing a read.
+
+# Reading Tags in Parallel
+# ------------------------
+# Which leaves the reads themselves. `[TinyTag.get(t) for t in tracks]` reads one file, waits for it, parses it and only then asks for the next. On a local disk the wait is short; on a network share it's most of the time, and it's time the CPU spends doing nothing. Reading ten files at once takes about as long as reading one.
+# 
+# `extract` runs a reader over a stream of paths on a pool:
+# 
+# * `read` is `TinyTag.get` by default, but anything that takes a path works -- `partial(File, easy=True)` for the mutagen version the API post used, or `read_tags` to get fixed up tags.
+# * Threads by default, since it's mostly waiting. `processes=True` uses processes instead, for when parsing is the slow part and the GIL gets in the way; then `read` and whatever it returns have to be picklable.
+# * No more than `in_flight` files are being read (or sitting finished, waiting to be handed back) at a time, so a 500,000 file library doesn't turn into 500,000 futures, and paths are only pulled from the walk as there's room for them.
+# * `ordered=True` hands results back in the same order as the paths went in. Otherwise they come back as they finish, so one slow file doesn't hold up everything behind it.
+# * Every path gets an `Extracted(path, tags, error)` back. A file that can't be read gets its exception in `error` instead of stopping everything else.
+# 
+# The demo's reader pretends to be a network share: 5ms of waiting per file, and one file that's broken.
+
+# In[10]:
+
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from time import sleep
+
+Extracted = namedtuple('Extracted', ['path', 'tags', 'error'])
+
+def _extract_one(read, fp):
+    try:
+        return Extracted(fp, read(fp), None)
+    except Exception as e:
+        return Extracted(fp, None, e)
+
+def extract(paths, read=TinyTag.get, workers=8, in_flight=None, ordered=False, processes=False):
+    '''Yield an Extracted for every path, reading them workers at a time.'''
+    in_flight = in_flight or workers * 2
+    paths = iter(paths)
+    executor = (ProcessPoolExecutor if processes else ThreadPoolExecutor)(workers)
+    submit = lambda fp: executor.submit(_extract_one, read, fp)
+    pending = deque(submit(fp) for fp in islice(paths, in_flight))
+    try:
+        if ordered:
+            while pending:
+                result = pending.popleft().result()
+                pending.extend(submit(fp) for fp in islice(paths, 1))
+                yield result
+        else:
+            pending = set(pending)
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                pending.update(submit(fp) for fp in islice(paths, len(done)))
+                yield from (future.result() for future in done)
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown()
+
+def network_read(fp):
+    '''path_tags, but slow, and one file is broken.'''
+    sleep(0.005)
+    if fp.endswith(path.join('Artist 1', 'Album 2', '04 Track.mp3')):
+        raise ValueError('not an mp3 after all')
+    return path_tags(fp)
+
+some = sorted(scan(library))[:400]
+
+for label, run in [('serial', lambda: [_extract_one(network_read, fp) for fp in some]),
+                   ('16 threads', lambda: list(extract(some, network_read, workers=16, ordered=True))),
+                   ('16 threads, unordered', lambda: list(extract(some, network_read, workers=16)))]:
+    start = time.perf_counter()
+    results = run()
+    took = time.perf_counter() - start
+    failed = [r for r in results if r.error]
+    print('{:<22} {:.2f}s, in order: {}, failed: {}'.format(
+          label, took, [r.path for r in results] == some, [(path.relpath(r.path, library), r.error) for r in failed]))
+
+
+# Out[10]:
+
+#     serial                 2.13s, in order: True, failed: [('Artist 1/Album 2/04 Track.mp3', ValueError('not an mp3 after all'))]
+#     16 threads             0.13s, in order: True, failed: [('Artist 1/Album 2/04 Track.mp3', ValueError('not an mp3 after all'))]
+#     16 threads, unordered  0.13s, in order: False, failed: [('Artist 1/Album 2/04 Track.mp3', ValueError('not an mp3 after all'))]
+# 
+
+# Sixteen reads waiting at once, about sixteen times faster -- on one core, because waiting is all they were doing. The broken file came back with its error in all three and the other 399 didn't care. How far that scales for real depends on how many requests the disk or the share will happily take at once, which is what `workers` and `in_flight` are for.
+
+# One Track at a Time
+# -------------------
+# Back at `get_music_files` I complained about holding everything in memory, and then every example since has done it anyway: a list of paths, then a list of `TinyTag`s, then another list of fixed ones, then `convert_tinytags` sorts that list (in place -- surprise, caller) so `groupby` can find the artists and albums, and builds sets and lists of models on top. By the end there are several copies of the whole library around at once, and the sort can't even start until the last file's been read.
+# 
+# None of it needs to be like that. The sort is only there so `groupby` sees each artist/album together, and that's only there so each artist and album gets added once -- which is what a dict keyed on the name does, without caring what order things turn up in. And `convert_track` from before already turns one track into its models. So every stage can be lazy:
+# 
+# * `scan` yields paths.
+# * `extract` reads them, with a bounded number in flight, and `tags_only` passes on the tags and puts aside the files that couldn't be read.
+# * `map(fix_track, ...)` fixes them one by one.
+# * `map(convert_track, ...)` turns each into an `(artist, album, track)`.
+# 
+# `pipeline` just feeds a source through stages like these, and `import_library` is those stages. Nothing happens until something pulls on the end of it, and at any point there's one track working its way through plus the handful `extract` has in flight. If you *do* want everything at the end, `group_models` is the hash based version of the grouping in `convert_tinytags`: same three lists back, first come first served, no sort.
+# 
+# To check that "flat" holds up, here's the old list at every stage way against the pipeline, on the made up library and on one twice its size, with `tracemalloc` keeping track of the peak. Both just add up the tracks' lengths at the end -- the kind of thing you'd do instead of keeping the models around, like writing them to a database.
+
+# In[11]:
+
+import tracemalloc
+from functools import reduce
+
+def pipeline(source, *stages):
+    '''Feed source through each stage in turn. Everything stays lazy.'''
+    return reduce(lambda items, stage: stage(items), stages, source)
+
+def tags_only(results, errors=None):
+    '''Pass on the tags from extract, setting aside the failures.'''
+    for result in results:
+        if result.error is None:
+            yield result.tags
+        elif errors is not None:
+            errors.append(result)
+
+def import_library(basedir, read=TinyTag.get, workers=8, errors=None, adaptor=adaptor):
+    '''Lazily yield (artist, album, track) for every track under basedir.'''
+    return pipeline(scan(basedir),
+                    partial(extract, read=read, workers=workers),
+                    partial(tags_only, errors=errors),
+                    partial(map, fix_track),
+                    partial(map, partial(convert_track, adaptor=adaptor)))
+
+def group_models(models):
+    '''convert_tinytags' grouping, with dicts instead of sorting.'''
+    artists, albums, tracks = {}, {}, []
+    for artist, album, track in models:
+        artists.setdefault(artist.name, artist)
+        albums.setdefault(album.name, album)
+        tracks.append(track)
+    return list(artists.values()), list(albums.values()), tracks
+
+def local_read(fp, read=path_tags):
+    '''Made up tags as an object, like TinyTag hands back. Tracks are cached
+    by name, so every made up track gets its own.
+    '''
+    return SimpleNamespace(**dict(read(fp), title=path.relpath(fp, library)))
+
+def with_lists(basedir):
+    tracks = list(scan(basedir))
+    tracks = [local_read(t) for t in tracks]
+    tracks = list(map(fix_track, tracks))
+    artists, albums, tracks = convert_tinytags(tracks)
+    return sum(t.length for t in tracks)
+
+def with_pipeline(basedir):
+    return sum(track.length for _, _, track in import_library(basedir, read=local_read))
+
+def peak(f, *args):
+    tracemalloc.start()
+    result = f(*args)
+    size = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, size
+
+bigger = tempfile.mkdtemp()
+make_library(bigger, artists=80)
+
+for name, root in [('library', library), ('bigger', bigger)]:
+    (old, old_peak), (new, new_peak) = peak(with_lists, root), peak(with_pipeline, root)
+    assert old == new
+    print('{:<8} {:>5} tracks: lists peak at {:>5.2f}MB, pipeline at {:.2f}MB'.format(
+          name, old // 180, old_peak / 2**20, new_peak / 2**20))
+
+errors = []
+artists, albums, tracks = group_models(import_library(library, read=partial(local_read, read=network_read), workers=16, errors=errors))
+print(len(artists), 'artists,', len(tracks), 'tracks,', len(errors), 'unreadable')
+
+# that's the last of the made up libraries
+shutil.rmtree(library)
+shutil.rmtree(bigger)
+
+
+# Out[11]:
+
+#     library   2400 tracks: lists peak at  1.97MB, pipeline at 0.11MB
+#     bigger    4800 tracks: lists peak at  3.87MB, pipeline at 0.11MB
+#     40 artists, 2399 tracks, 1 unreadable
+# 
+
+# Same total both ways. Twice the library, twice the peak for the lists, and the pipeline doesn't move -- these tags are tiny, so with real `TinyTag` objects the gap only gets wider. Grouping still works when you want the whole lot, and the broken file got set aside rather than stopping the import.
+
+# Tracks as Columns
+# -----------------
+# Last thing. The models are fine for a few dozen tracks, but each `Track` is an object with its own `__dict__` holding six attributes, two of them references back up to its album and artist, and an id -- and that's a couple hundred bytes before counting the name. Multiply by a few hundred thousand tracks and the models outweigh everything else.
+# 
+# Most of what's in a track is small numbers: which album, which artist, position, length. So `Library` keeps every track as one row across a set of columns -- `array`s of machine integers, four bytes a value (two for the position), no object per track at all. Artists and albums are stored once each and referred to by their index (interned, the same as the `@cache` registries do by name), and the id of anything is just its row plus one. Even the names aren't objects: they're packed end to end into one `bytearray` as UTF-8, with another column saying where each one ends, and only become strings again when someone asks for one.
+# 
+# To keep the same questions answerable, each album keeps an array of its track rows and each artist an array of its album indices, filled in as tracks are added. Asking for something hands out a small view object -- `__slots__`, two fields: the library and the row -- that looks up its attributes in the columns when asked. `artist.albums`, `album.tracks`, `track.album`, `track.artist`, `by_name` and sorting all work the way they did, and the `repr`s match, so code that reads the models shouldn't notice. Views are made when asked for and thrown away, so keep one around if you're going to use it a lot.
+# 
+# One deliberate difference: albums are keyed by artist *and* name, so two artists' albums called "Greatest Hits" stay separate. The `@cache` registries key everything on the name alone. And a column can only hold what fits in it, so `add` tidies up first: a missing title is stored as an empty name, lengths are rounded to whole seconds, and a track number that isn't a whole number (tags like `'3/12'` do turn up) or a length that won't fit is stored as missing and comes back as `None`.
+# 
+# The comparison is 100,000 made up tracks -- 1000 artists with 10 albums of 10 tracks each -- built both ways and kept alive, with `tracemalloc` counting what's left afterwards.
+
+# In[12]:
+
+from array import array
+
+class _View(object):
+    '''A row of a Library, looked up on demand.'''
+    __slots__ = ('lib', 'i')
+
+    def __init__(self, lib, i):
+        self.lib = lib
+        self.i = i
+
+    @property
+    def id(self):
+        return self.i + 1
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.lib is other.lib and self.i == other.i
+
+    def __hash__(self):
+        return hash((type(self), id(self.lib), self.i))
+
+    def __lt__(self, other):
+        return self._cmpkey() < other._cmpkey()
+
+class ArtistView(_View):
+    __slots__ = ()
+
+    @property
+    def name(self):
+        return self.lib.artist_names[self.i]
+
+    @property
+    def albums(self):
+        return {self.lib.album_names[b]: AlbumView(self.lib, b) for b in self.lib.artist_albums[self.i]}
+
+    def _cmpkey(self):
+        return (self.name, self.id)
+
+    def __repr__(self):
+        return "<Artist name={} id={}>".format(self.name, self.id)
+
+class AlbumView(_View):
+    __slots__ = ()
+
+    @property
+    def name(self):
+        return self.lib.album_names[self.i]
+
+    @property
+    def artist(self):
+        return ArtistView(self.lib, self.lib.album_artist[self.i])
+
+    @property
+    def tracks(self):
+        return [TrackView(self.lib, t) for t in self.lib.album_tracks[self.i]]
+
+    def _cmpkey(self):
+        return (self.artist.name, self.name, self.id)
+
+    def __repr__(self):
+        return "<Album name={} artist={} id={}>".format(self.name, self.artist.name, self.id)
+
+class TrackView(_View):
+    __slots__ = ()
+
+    @property
+    def name(self):
+        ends = self.lib.track_name_ends
+        start = ends[self.i - 1] if self.i else 0
+        return self.lib.track_names[start:ends[self.i]].decode('utf-8')
+
+    @property
+    def track(self):
+        position = self.lib.track_position[self.i]
+        return None if position < 0 else position
+
+    @property
+    def length(self):
+        length = self.lib.track_length[self.i]
+        return None if length < 0 else length
+
+    @property
+    def album(self):
+        return AlbumView(self.lib, self.lib.track_album[self.i])
+
+    @property
+    def artist(self):
+        return ArtistView(self.lib, self.lib.track_artist[self.i])
+
+    def _cmpkey(self):
+        return (self.album.name, self.track or 0, self.name, self.id)
+
+    def __repr__(self):
+        return "<Track artist={} album={} track={} name={} id={}>".format(
+               self.artist.name, self.album.name, self.track, self.name, self.id)
+
+class Library(object):
+    '''Artists, albums and tracks stored as columns rather than objects.'''
+    def __init__(self):
+        self.artist_names = []
+        self.artist_ids = {}
+        self.artist_albums = []
+        self.album_names = []
+        self.album_artist = array('i')
+        self.album_ids = {}
+        self.album_tracks = []
+        # every track name, back to back as utf-8, and where each one ends
+        self.track_names = bytearray()
+        self.track_name_ends = array('q')
+        self.track_album = array('i')
+        self.track_artist = array('i')
+        self.track_position = array('h')
+        self.track_length = array('i')
+
+    def _artist(self, name):
+        i = self.artist_ids.get(name)
+        if i is None:
+            i = self.artist_ids[name] = len(self.artist_names)
+            self.artist_names.append(name)
+            self.artist_albums.append(array('i'))
+        return i
+
+    def _album(self, artist, name):
+        i = self.album_ids.get((artist, name))
+        if i is None:
+            i = self.album_ids[(artist, name)] = len(self.album_names)
+            self.album_names.append(name)
+            self.album_artist.append(artist)
+            self.album_tracks.append(array('i'))
+            self.artist_albums[artist].append(i)
+        return i
+
+    def add(self, name, track, length, artist=None, album=None):
+        '''Same arguments as Track, so Track(**adaptor(t)) becomes library.add(**adaptor(t)).'''
+        # everything is checked before anything is appended, so the columns stay the same length
+        name = b'' if name is None else str(name).encode('utf-8')
+        if not isinstance(track, int) or not 0 <= track < 2**15:
+            track = -1
+        try:
+            length = round(length)
+        except (TypeError, ValueError, OverflowError):
+            length = -1
+        if not 0 <= length < 2**31:
+            length = -1
+        a = self._artist(artist)
+        b = self._album(a, album)
+        row = len(self.track_name_ends)
+        self.track_names += name
+        self.track_name_ends.append(len(self.track_names))
+        self.track_album.append(b)
+        self.track_artist.append(a)
+        self.track_position.append(track)
+        self.track_length.append(length)
+        self.album_tracks[b].append(row)
+        return TrackView(self, row)
+
+    def by_name(self, name):
+        '''Artist.by_name: the artist called name, or None.'''
+        i = self.artist_ids.get(name)
+        return None if i is None else ArtistView(self, i)
+
+    def __len__(self):
+        return len(self.track_name_ends)
+
+def fake_tracks(artists=1000, albums=10, tracks=10):
+    for a in range(artists):
+        for b in range(albums):
+            for t in range(tracks):
+                yield {'artist': 'Artist {}'.format(a), 'album': 'Album {}-{}'.format(a, b),
+                       'name': 'Track {}-{}-{}'.format(a, b, t), 'track': t + 1, 'length': 180 + t}
+
+def with_models():
+    keep = []
+    for info in fake_tracks():
+        keep.append(Artist(name=info['artist']))
+        keep.append(Album(name=info['album'], artist=info['artist']))
+        keep.append(Track(**info))
+    return keep
+
+def with_columns():
+    library = Library()
+    for info in fake_tracks():
+        library.add(**info)
+    return library
+
+for label, build in [('models', with_models), ('columns', with_columns)]:
+    tracemalloc.start()
+    built = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print('{:<8} {:>6.1f}MB'.format(label, size / 2**20))
+    if label == 'models':
+        del built
+
+artist = built.by_name('Artist 42')
+album = sorted(artist.albums.values())[3]
+print(artist, album, *album.tracks[:3], sep='\n')
+print(album.tracks[0].album == album, album.artist == artist, len(built))
+
+
+# Out[12]:
+
+#     models     40.5MB
+#     columns     7.0MB
+#     <Artist name=Artist 42 id=43>
+#     <Album name=Album 42-3 artist=Artist 42 id=424>
+#     <Track artist=Artist 42 album=Album 42-3 track=1 name=Track 42-3-0 id=4231>
+#     <Track artist=Artist 42 album=Album 42-3 track=2 name=Track 42-3-1 id=4232>
+#     <Track artist=Artist 42 album=Album 42-3 track=3 name=Track 42-3-2 id=4233>
+#     True True 100000
+# 
+
+# About a sixth of the memory for the same hundred thousand tracks, and the same answers to the same questions. Most of what's left is per album rather than per track -- 10,000 albums is a lot of albums for 100,000 tracks -- so a real library, with more tracks to an album, should come out further ahead. The cost is on the way out: every attribute is a lookup into a column, and every name gets decoded, which doesn't matter for showing a page of an album and does if you're walking the whole library over and over.
 # 
 # Now that I've digressed completely from audio metadata to quickly processing through files, I think I'll end here.
@@ -295,7 +295,7 @@ def synchronize(lock):
         def locker(*args, **kw):
             lock.acquire()
             try:
-                f(*args, **kw)
+                return f(*args, **kw)
             finally:
                 lock.release()
         return locker
@@ -697,6 +697,1739 @@ print(memo.cache)
 #     defaultdict(<class 'dict'>, {'is_even': {'(5,){}': False, '(34,){}': True}, 'Point': {'(3, 4){}': <__main__.Point object at 0x7fa8a40410f0>}})
 # 
 
+# Memoizing Without The Memory Leak
+# ---------------------------------
+# That `memoize` class has two problems if you let it anywhere near a long running process. Every call does `"{!r}{!r}".format(args, kw)` just to *look up* the answer, which gets expensive fast if an argument is a big list or a dictionary. And the cache never forgets anything, so it grows until something falls over.
+# 
+# The key is easy to fix: the arguments tuple is already hashable (if what's in it is), and keyword arguments go in as a `frozenset` so their order doesn't matter. If something isn't hashable, the call just skips the cache instead of blowing up.
+# 
+# For the forgetting, there's a choice of who gets kicked out when the cache is full:
+# 
+# * LRU -- least recently used. An `OrderedDict` moves each hit to the end, and the front is what goes.
+# * LFU -- least frequently used. Keys are bucketed by how many times they've been hit, and the least used key in the lowest bucket goes. Keeping track of the lowest bucket makes that `O(1)` too.
+# * TTL -- time to live. Entries expire `ttl` seconds after they're cached, and if it's full anyway the oldest goes first. Expired entries are cleared out whenever something new is cached, so keys that are never asked for again don't pile up.
+# 
+# Full means either `maxsize` entries or `maxbytes` worth of results -- measured with `sys.getsizeof`, which doesn't follow references, so a list of strings only counts the list itself. Hits, misses and evictions are counted so you can tell whether the cache is pulling its weight.
+
+# In[18]:
+
+import sys
+import time
+from collections import OrderedDict, namedtuple
+
+_kw_mark = object()
+
+def make_key(args, kw):
+    '''Hashable key for a call. Keyword order doesn't matter.'''
+    if kw:
+        return args + (_kw_mark, frozenset(kw.items()))
+    return args
+
+class _LRU(object):
+    def __init__(self, ttl=None):
+        self.data = OrderedDict()
+
+    def __len__(self):
+        return len(self.data)
+
+    def get(self, key):
+        value = self.data[key]
+        self.data.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self.data[key] = value
+
+    def evict(self):
+        return self.data.popitem(last=False)[0]
+
+class _LFU(object):
+    def __init__(self, ttl=None):
+        self.data = {}
+        # frequency -> keys with that frequency, least recent first
+        self.freqs = defaultdict(OrderedDict)
+        self.min_freq = 0
+
+    def __len__(self):
+        return len(self.data)
+
+    def get(self, key):
+        value, freq = self.data[key]
+        bucket = self.freqs[freq]
+        del bucket[key]
+        if not bucket:
+            del self.freqs[freq]
+            if self.min_freq == freq:
+                self.min_freq = freq + 1
+        self.freqs[freq+1][key] = None
+        self.data[key] = (value, freq+1)
+        return value
+
+    def put(self, key, value):
+        self.data[key] = (value, 1)
+        self.freqs[1][key] = None
+        self.min_freq = 1
+
+    def evict(self):
+        bucket = self.freqs[self.min_freq]
+        key, _ = bucket.popitem(last=False)
+        if not bucket:
+            del self.freqs[self.min_freq]
+            self.min_freq = min(self.freqs) if self.freqs else 0
+        del self.data[key]
+        return key
+
+class _TTL(object):
+    def __init__(self, ttl):
+        if ttl is None:
+            raise ValueError('TTL policy needs a ttl')
+        self.ttl = ttl
+        self.data = OrderedDict()
+
+    def __len__(self):
+        return len(self.data)
+
+    def get(self, key):
+        expires, value = self.data[key]
+        if expires < time.monotonic():
+            del self.data[key]
+            raise KeyError(key)
+        return value
+
+    def put(self, key, value):
+        # clear out what's expired, even if it's never asked for again,
+        # and hand the keys back so their sizes can be forgotten too
+        now = time.monotonic()
+        expired = []
+        # every ttl is the same, so the oldest entries expire first
+        while self.data:
+            oldest = next(iter(self.data))
+            if self.data[oldest][0] >= now:
+                break
+            del self.data[oldest]
+            expired.append(oldest)
+        self.data[key] = (now + self.ttl, value)
+        return expired
+
+    def evict(self):
+        return self.data.popitem(last=False)[0]
+
+policies = {'lru': _LRU, 'lfu': _LFU, 'ttl': _TTL}
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'evictions', 'size', 'nbytes'])
+
+class bounded_memoize(wrapper):
+    '''Caches a function's results, evicting by policy once the cache
+    holds maxsize entries or maxbytes worth of results.
+    '''
+    def __init__(self, f, maxsize=128, maxbytes=None, policy='lru', ttl=None):
+        self.store = policies[policy](ttl)
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.sizes = {}
+        self.nbytes = 0
+        self.hits = self.misses = self.evictions = 0
+        super().__init__(f)
+
+    def __call__(self, *args, **kw):
+        try:
+            key = make_key(args, kw)
+            value = self.store.get(key)
+        except KeyError:
+            # might be a ttl expiry, so forget its size
+            self.nbytes -= self.sizes.pop(key, 0)
+        except TypeError:
+            # unhashable arguments, can't cache this one
+            return self.f(*args, **kw)
+        else:
+            self.hits += 1
+            return value
+
+        self.misses += 1
+        value = self.f(*args, **kw)
+        self._put(key, value)
+        return value
+
+    def _evict(self):
+        key = self.store.evict()
+        self.nbytes -= self.sizes.pop(key, 0)
+        self.evictions += 1
+
+    def _put(self, key, value):
+        # evict *before* adding, otherwise LFU would
+        # throw out the newcomer with its count of 1
+        if self.maxsize is not None:
+            while self.store and len(self.store) >= self.maxsize:
+                self._evict()
+        if self.maxbytes is not None:
+            size = sys.getsizeof(value)
+            if size > self.maxbytes:
+                return
+            while self.store and self.nbytes + size > self.maxbytes:
+                self._evict()
+            self.sizes[key] = size
+            self.nbytes += size
+        for old in self.store.put(key, value) or ():
+            self.nbytes -= self.sizes.pop(old, 0)
+
+    def cache_info(self):
+        return CacheInfo(self.hits, self.misses, self.evictions, len(self.store), self.nbytes)
+
+def memoize_with(maxsize=128, maxbytes=None, policy='lru', ttl=None):
+    '''Decorator factory for bounded_memoize.'''
+    return partial(bounded_memoize, maxsize=maxsize, maxbytes=maxbytes, policy=policy, ttl=ttl)
+
+@memoize_with(maxsize=2, policy='lfu')
+def square(x):
+    return x*x
+
+for n in [2, 2, 2, 3, 4, 2, 3]:
+    square(n)
+print('lfu square: ', square.cache_info())
+
+@memoize_with(maxsize=None, policy='ttl', ttl=0.01)
+def now(_):
+    return time.monotonic()
+
+first = now(1)
+assert now(1) == first
+time.sleep(0.02)
+assert now(1) != first
+print('ttl now: ', now.cache_info())
+
+@memoize
+def old_total(items):
+    return sum(items)
+
+@memoize_with(maxsize=16)
+def new_total(items):
+    return sum(items)
+
+big = tuple(range(1000))
+# prime the old cache by hand, otherwise it prints all thousand numbers
+old_total.lookup["{!r}{!r}".format((big,), {})] = sum(big)
+new_total(big)
+get_ipython().magic('timeit -n 1000 -r 5 old_total(big)')
+get_ipython().magic('timeit -n 1000 -r 5 new_total(big)')
+
+
+# Out[18]:
+
+#     lfu square:  CacheInfo(hits=3, misses=4, evictions=2, size=2, nbytes=0)
+#     ttl now:  CacheInfo(hits=1, misses=2, evictions=0, size=1, nbytes=0)
+#     1000 loops, best of 5: 139 µs per loop
+#     1000 loops, best of 5: 14.6 µs per loop
+# 
+
+# Hashing a thousand item tuple still isn't free (tuples don't remember their hash), but it's a tenth of the cost of building its repr. Worth noting that `mul(3)` and `mul(x=3)` still get cached separately -- figuring out that those are the same call means binding them against the signature, and that costs more than it saves for most functions.
+
+# Memoizing With Friends
+# ----------------------
+# None of the memoizers here are thread safe, which mostly means they're *wasteful*: if ten threads ask for the same uncached key at once, all ten see a miss and all ten do the expensive thing. Put an expensive lookup behind a web API and that's exactly what happens the moment a popular key expires -- a thundering herd.
+# 
+# The fix is to remember not just the answers but the questions that are currently being answered. The first thread to miss on a key puts a `Future` in an in-flight table and goes off to compute. Anyone else who misses on that key finds the `Future` and waits on it instead of computing it again. When the owner's done, the result goes in the cache and every waiter wakes up with it (or with the exception, if it blew up -- which doesn't get cached, so the next caller tries again). The lock only guards the tables, never the function call, so different keys don't wait on each other.
+# 
+# `async def` functions get the same treatment with an `asyncio` task as the shared awaitable. Each waiter awaits it through `asyncio.shield`, so one caller getting cancelled doesn't cancel the work for everyone else.
+# 
+# This builds on `bounded_memoize`, so it gets the same eviction policies and counters, plus a count of how many calls got coalesced into someone else's.
+
+# In[19]:
+
+import asyncio
+import inspect
+from concurrent.futures import Future, ThreadPoolExecutor
+
+CoalesceInfo = namedtuple('CoalesceInfo', CacheInfo._fields + ('coalesced',))
+
+class coalescing_memoize(bounded_memoize):
+    '''Thread safe bounded_memoize where concurrent misses on the same key
+    share one call to the wrapped function. Works for async def too.
+    '''
+    def __init__(self, f, **opts):
+        super().__init__(f, **opts)
+        self.lock = Lock()
+        self.inflight = {}
+        self.coalesced = 0
+        self.is_async = inspect.iscoroutinefunction(f)
+
+    def _lookup(self, key):
+        '''Returns (cached, value, pending), where pending is whatever's
+        already computing key. Must hold the lock.
+        '''
+        try:
+            value = self.store.get(key)
+        except KeyError:
+            self.nbytes -= self.sizes.pop(key, 0)
+        else:
+            self.hits += 1
+            return True, value, None
+        pending = self.inflight.get(key)
+        if pending is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+        return False, None, pending
+
+    def __call__(self, *args, **kw):
+        try:
+            key = make_key(args, kw)
+            hash(key)
+        except TypeError:
+            return self.f(*args, **kw)
+        if self.is_async:
+            return self._acall(key, args, kw)
+
+        with self.lock:
+            cached, value, pending = self._lookup(key)
+            if cached:
+                return value
+            if pending is None:
+                future = self.inflight[key] = Future()
+        if pending is not None:
+            return pending.result()
+
+        try:
+            value = self.f(*args, **kw)
+        except BaseException as e:
+            with self.lock:
+                del self.inflight[key]
+            future.set_exception(e)
+            raise
+        with self.lock:
+            del self.inflight[key]
+            self._put(key, value)
+        future.set_result(value)
+        return value
+
+    async def _acall(self, key, args, kw):
+        with self.lock:
+            cached, value, task = self._lookup(key)
+            if cached:
+                return value
+            if task is None:
+                task = self.inflight[key] = asyncio.ensure_future(self.f(*args, **kw))
+                task.add_done_callback(partial(self._finished, key))
+        return await asyncio.shield(task)
+
+    def _finished(self, key, task):
+        with self.lock:
+            del self.inflight[key]
+            if not task.cancelled() and task.exception() is None:
+                self._put(key, task.result())
+
+    def cache_info(self):
+        return CoalesceInfo(*super().cache_info(), coalesced=self.coalesced)
+
+def coalesce_with(maxsize=128, maxbytes=None, policy='lru', ttl=None):
+    '''Decorator factory for coalescing_memoize.'''
+    return partial(coalescing_memoize, maxsize=maxsize, maxbytes=maxbytes, policy=policy, ttl=ttl)
+
+calls = []
+
+@coalesce_with()
+def slow_lookup(n):
+    calls.append(n)
+    sleep(0.1)
+    return n*2
+
+with ThreadPoolExecutor(max_workers=10) as pool:
+    print(list(pool.map(slow_lookup, [1]*10 + [2]*5)))
+print('thread calls: ', calls, slow_lookup.cache_info())
+
+calls = []
+
+@coalesce_with()
+async def aslow_lookup(n):
+    calls.append(n)
+    await asyncio.sleep(0.1)
+    return n*2
+
+async def herd():
+    return await asyncio.gather(*[aslow_lookup(n) for n in [1]*10 + [2]*5])
+
+print(asyncio.run(herd()))
+print('async calls: ', calls, aslow_lookup.cache_info())
+
+
+# Out[19]:
+
+#     [2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 4, 4, 4, 4, 4]
+#     thread calls:  [1, 2] CoalesceInfo(hits=0, misses=2, evictions=0, size=2, nbytes=0, coalesced=13)
+#     [2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 4, 4, 4, 4, 4]
+#     async calls:  [1, 2] CoalesceInfo(hits=0, misses=2, evictions=0, size=2, nbytes=0, coalesced=13)
+# 
+
+# Fifteen calls, two computations, thirteen callers who waited on someone else's work instead of repeating it. The one catch with threads is that a waiter blocks for as long as the owner takes, with no timeout -- if that's a problem, `pending.result(timeout=...)` is right there.
+
+# Memoizing Methods Properly
+# --------------------------
+# `objectmemo` gets methods working by handing back `partial(self.__call__, obj)`, which has a few problems. There's a new `partial` every time the method's looked up. The instance ends up in the cache key by its `repr`, and the default `repr` is built from `id`, which gets reused once an object dies -- so a brand new object can pick up a dead one's cached answers. And since the cache lives on the decorator, it's shared by every instance the class has ever had and never forgets any of them.
+# 
+# Better to give each instance its own cache that dies with it. The first time the method's looked up on an instance, `memoized_method` stashes a small cache-holding callable in the instance's `__dict__` (under `_memoized_<name>`, so the method itself stays visible), and every lookup after that just fetches it back out -- nothing to allocate, no arguments to bind.
+# 
+# The callable holds the instance through a weak reference, otherwise instance -> cache -> instance is a cycle and it'd hang around until the garbage collector got to it. On a hit it doesn't need the instance at all, only on a miss. Every lookup checks that the callable really belongs to the instance it was found on: `copy.copy` copies the `__dict__` as is, and a copy mustn't answer with the original's results (or call the method on the original, or on nothing once the original's gone). Pickling drops the cache rather than trying to save it. Classes with `__slots__` don't have a `__dict__` to stash things in, so those fall back to a dict on the descriptor keyed on the instance's `id` -- not the instance itself, since two instances that compare equal still need a cache each -- with the weak reference's callback taking the entry out when the instance goes (add `'__weakref__'` to the slots). Arguments that can't be hashed skip the cache, the same as `bounded_memoize`.
+
+# In[20]:
+
+import weakref
+
+def _dropped():
+    return None
+
+class _bound_memo(object):
+    __slots__ = ('f', 'ref', 'cache')
+
+    def __init__(self, f, obj, callback=None):
+        self.f = f
+        self.ref = weakref.ref(obj, callback)
+        self.cache = {}
+
+    def __reduce__(self):
+        # the cache isn't part of the instance's state, it comes back empty
+        return (_dropped, ())
+
+    def __call__(self, *args, **kw):
+        try:
+            key = make_key(args, kw)
+            return self.cache[key]
+        except KeyError:
+            value = self.cache[key] = self.f(self.ref(), *args, **kw)
+            return value
+        except TypeError:
+            # unhashable arguments, can't cache this one
+            return self.f(self.ref(), *args, **kw)
+
+class memoized_method(object):
+    '''Caches a method's results per instance, freed with the instance.'''
+    def __init__(self, f):
+        self.f = f
+        self.__set_name__(None, f.__name__)
+        self.__doc__ = f.__doc__
+        # id(instance) -> _bound_memo, for instances without a __dict__
+        self.bound = {}
+
+    def __set_name__(self, owner, name):
+        self.name = name
+        self.attr = '_memoized_' + name
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        try:
+            namespace = obj.__dict__
+        except AttributeError:
+            # __slots__, no __dict__ to hide in. Keyed on id rather than
+            # the instance, since equal instances still need their own cache
+            key = id(obj)
+            memo = self.bound.get(key)
+            if memo is None or memo.ref() is not obj:
+                memo = self.bound[key] = _bound_memo(self.f, obj, partial(self._forget, key))
+            return memo
+        memo = namespace.get(self.attr)
+        if memo is None or memo.ref() is not obj:
+            # first lookup, or a copy still holding the original's cache
+            memo = namespace[self.attr] = _bound_memo(self.f, obj)
+        return memo
+
+    def _forget(self, key, ref):
+        # unless the id's already been reused by a newer instance
+        memo = self.bound.get(key)
+        if memo is not None and memo.ref is ref:
+            del self.bound[key]
+
+class Thing(object):
+    def __init__(self, name):
+        self.name = name
+
+    @memoized_method
+    def roar(self, phrase):
+        print('Roaring {!r}'.format(phrase))
+        return "{}!!!".format(phrase.upper())
+
+class SlottedThing(object):
+    __slots__ = ('name', '__weakref__')
+
+    def __init__(self, name):
+        self.name = name
+
+    @memoized_method
+    def roar(self, phrase):
+        return "{}!!!".format(phrase.upper())
+
+ben_grimm = Thing('Ben Grimm')
+print(ben_grimm.roar(phrase="it's clobbering time"))
+print(ben_grimm.roar(phrase="it's clobbering time"))
+assert ben_grimm.roar is ben_grimm.__dict__['_memoized_roar']
+
+slotted = SlottedThing('Slotted Grimm')
+print(slotted.roar("it's clobbering time"))
+
+ref = weakref.ref(ben_grimm)
+del ben_grimm, slotted
+print('Ben Grimm after del: ', ref())
+print('Slotted caches left: ', len(SlottedThing.roar.bound))
+
+class OldThing(object):
+    @objectmemo
+    def roar(self, phrase):
+        return "{}!!!".format(phrase.upper())
+
+old, new = OldThing(), Thing('new')
+old.roar('hi'), new.roar('hi')
+get_ipython().magic("timeit -n 10000 -r 5 old.roar('hi')")
+get_ipython().magic("timeit -n 10000 -r 5 new.roar('hi')")
+
+
+# Out[20]:
+
+#     Roaring "it's clobbering time"
+#     IT'S CLOBBERING TIME!!!
+#     IT'S CLOBBERING TIME!!!
+#     IT'S CLOBBERING TIME!!!
+#     Ben Grimm after del:  None
+#     Slotted caches left:  0
+#     Caching args ((<__main__.OldThing object at 0x7f9da4bcbd90>, 'hi'){}) and result now.
+#     Roaring 'hi'
+#     10000 loops, best of 5: 3.04 µs per loop
+#     10000 loops, best of 5: 921 ns per loop
+# 
+
+# Several times faster on a hit, because after the first lookup it's a dict lookup to find the cache, a check that it's this instance's, and a dict lookup to find the answer. And the instance really does go away the moment its last reference does, cache and all.
+
+# Memoizing Across Restarts
+# -------------------------
+# `Memoize` keeps everything in a `defaultdict` that vanishes when the process does, so every deploy starts cold and recomputes everything from scratch. For pure functions that are expensive enough to cache in the first place, that's a lot of wasted work.
+# 
+# So the storage becomes pluggable. A backend only has to do four things: `get` (raising `KeyError` on a miss), `set`, `clear`, and `register`, which is called once per decorated function with a *version* of that function. The in memory `DictBackend` is what `Memoize` was doing all along. `SqliteBackend` puts it all in a sqlite file (no server, it's in the standard library, and it handles more than one process reading at once).
+# 
+# Keys have to mean the same thing from one run to the next, so `repr` is out (ids again) and so is `hash` (strings hash differently every run). Instead, the arguments get pickled and hashed with SHA1 -- the *content* is the key. The function's version is a hash of its source (or its bytecode, if the source can't be found), so changing the function throws out everything it cached; old answers from old code aren't answers anymore. Values are pickled, so anything you want to cache has to be picklable. A call whose arguments can't be pickled (a lock, a lambda, an open file) just isn't cached, the same as unhashable arguments with `bounded_memoize`.
+
+# In[21]:
+
+import hashlib
+import marshal
+import os
+import pickle
+import sqlite3
+
+def content_key(args, kw):
+    '''Stable key for a call: the same arguments give the same key in any process.'''
+    payload = pickle.dumps((args, sorted(kw.items())), protocol=4)
+    return hashlib.sha1(payload).digest()
+
+def source_version(f):
+    '''Hash of the function's source, so editing it invalidates its cache.'''
+    try:
+        source = inspect.getsource(f).encode('utf-8')
+    except (OSError, TypeError):
+        source = marshal.dumps(f.__code__)
+    return hashlib.sha1(source).hexdigest()
+
+class DictBackend(object):
+    '''In memory and gone at exit, just like Memoize.'''
+    def __init__(self):
+        self.cache = defaultdict(dict)
+        self.versions = {}
+
+    def register(self, func, version):
+        if self.versions.get(func) != version:
+            self.cache.pop(func, None)
+        self.versions[func] = version
+
+    def get(self, func, key):
+        return self.cache[func][key]
+
+    def set(self, func, key, value):
+        self.cache[func][key] = value
+
+    def clear(self, func=None):
+        if func is None:
+            self.cache.clear()
+        else:
+            self.cache.pop(func, None)
+
+class SqliteBackend(object):
+    '''Pickles results into a sqlite database that outlives the process.'''
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.versions = {}
+        with self.conn:
+            self.conn.execute('''CREATE TABLE IF NOT EXISTS memo (
+                                    func TEXT, version TEXT, key BLOB, value BLOB,
+                                    PRIMARY KEY (func, key))''')
+
+    def register(self, func, version):
+        with self.conn:
+            self.conn.execute('DELETE FROM memo WHERE func = ? AND version != ?', (func, version))
+        self.versions[func] = version
+
+    def get(self, func, key):
+        row = self.conn.execute('SELECT value FROM memo WHERE func = ? AND key = ?', (func, key)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return pickle.loads(row[0])
+
+    def set(self, func, key, value):
+        with self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO memo VALUES (?, ?, ?, ?)',
+                              (func, self.versions[func], key, pickle.dumps(value, protocol=4)))
+
+    def clear(self, func=None):
+        with self.conn:
+            if func is None:
+                self.conn.execute('DELETE FROM memo')
+            else:
+                self.conn.execute('DELETE FROM memo WHERE func = ?', (func,))
+
+class PersistentMemoize(object):
+    '''Memoize, but with the storage handed off to a backend.'''
+    def __init__(self, backend=None):
+        self.backend = backend or DictBackend()
+
+    def __call__(self, obj):
+        func = '{}.{}'.format(obj.__module__, obj.__qualname__)
+        self.backend.register(func, source_version(obj))
+
+        @wraps(obj)
+        def cacher(*args, **kw):
+            try:
+                key = content_key(args, kw)
+            except (TypeError, AttributeError, pickle.PicklingError):
+                # arguments that can't be pickled can't be keyed, don't cache this one
+                return obj(*args, **kw)
+            try:
+                return self.backend.get(func, key)
+            except KeyError:
+                value = obj(*args, **kw)
+                self.backend.set(func, key, value)
+                return value
+        return cacher
+
+def slow_fib(n):
+    sleep(0.5)
+    return next(islice(_fib(), n, None))
+
+# a fresh PersistentMemoize and backend each time is a stand in for a restart
+for run in range(2):
+    disk_memo = PersistentMemoize(SqliteBackend('memo.sqlite'))
+    fib = disk_memo(slow_fib)
+    started = time.monotonic()
+    print('run {}: fib(100) = {} in {:.2f}s'.format(run, fib(100), time.monotonic() - started))
+
+mem_fib = PersistentMemoize()(slow_fib)
+mem_fib(100)
+get_ipython().magic('timeit -n 1000 -r 5 fib(100)')
+get_ipython().magic('timeit -n 1000 -r 5 mem_fib(100)')
+os.remove('memo.sqlite')
+
+
+# Out[21]:
+
+#     run 0: fib(100) = 354224848179261915075 in 0.50s
+#     run 1: fib(100) = 354224848179261915075 in 0.00s
+#     1000 loops, best of 5: 10 µs per loop
+#     1000 loops, best of 5: 1.6 µs per loop
+# 
+
+# The second "process" never calls `slow_fib` at all. A sqlite hit is slower than a dict hit, of course -- pickling the key, a query, unpickling the value -- so this is for functions that take milliseconds or more, not for replacing the in memory caches.
+
+# Retrying Politely
+# -----------------
+# `retry` has a few habits that don't scale. It calls `time.sleep`, which blocks the whole thread -- and in an async server, the whole event loop, so every other request waits on one flaky call. It only retries on falsy results, but most things fail by raising. And every client that failed at the same moment backs off by exactly the same amount and comes back at exactly the same moment, which is how a service that hiccuped once gets hammered again on every retry.
+# 
+# `backoff_retry` keeps the shape (`times`, `delay`, `backoff`, raise `exc` when it gives up) and adds:
+# 
+# * `retry_on` -- a tuple of exception types worth retrying. Anything else is a real bug and goes straight through. The last exception is chained onto `exc` so it isn't lost.
+# * `jitter` -- `'full'` sleeps a random amount between 0 and the backoff delay. `'decorrelated'` picks between the base delay and three times the last sleep, so clients drift apart from each other over time. `None` is the old fixed schedule.
+# * `cap` -- the longest any one sleep is allowed to be.
+# * `deadline` -- a total time budget in seconds. If the next sleep would go past it, there's no point sleeping, so it gives up right away.
+# 
+# If the decorated function is `async def`, the wrapper is too, and it sleeps with `asyncio.sleep` so the event loop keeps running in the meantime. The schedule logic lives in one generator that both versions share.
+
+# In[22]:
+
+from random import uniform
+
+def _delays(delay, backoff, cap, jitter):
+    '''Endless schedule of sleeps between attempts.'''
+    sleep_for = delay
+    while True:
+        if jitter == 'full':
+            yield uniform(0, min(cap, sleep_for))
+            sleep_for *= backoff
+        elif jitter == 'decorrelated':
+            sleep_for = min(cap, uniform(delay, sleep_for * 3))
+            yield sleep_for
+        else:
+            yield min(cap, sleep_for)
+            sleep_for *= backoff
+
+def backoff_retry(times=3, delay=1, backoff=2, exc=Exception, false=False,
+                  retry_on=(), jitter='full', cap=60, deadline=None):
+    '''Retry on falsy results or on any exception in retry_on, sleeping with
+    jittered exponential backoff in between. Supports async def functions.
+    '''
+    def give_up(f, attempts, last):
+        raise exc("Attempted {!r} {!r} times, failed to return result".format(f, attempts)) from last
+
+    def attempts(started):
+        '''Yields how long to sleep before each retry, then returns
+        how many attempts were made once it's out of tries or time.
+        '''
+        schedule = _delays(delay, backoff, cap, jitter)
+        for attempt in range(1, times):
+            wait = next(schedule)
+            if deadline is not None and time.monotonic() - started + wait > deadline:
+                return attempt
+            yield wait
+        return times
+
+    def succeeded(result):
+        return result or (false and not result)
+
+    def wrapper(f):
+        if inspect.iscoroutinefunction(f):
+            @wraps(f)
+            async def trier(*args, **kw):
+                last = None
+                # taken now, so the first attempt counts against the deadline too
+                waits = attempts(time.monotonic())
+                while True:
+                    try:
+                        result = await f(*args, **kw)
+                        if succeeded(result):
+                            return result
+                    except retry_on as e:
+                        last = e
+                    try:
+                        await asyncio.sleep(next(waits))
+                    except StopIteration as stop:
+                        give_up(f, stop.value, last)
+        else:
+            @wraps(f)
+            def trier(*args, **kw):
+                last = None
+                # taken now, so the first attempt counts against the deadline too
+                waits = attempts(time.monotonic())
+                while True:
+                    try:
+                        result = f(*args, **kw)
+                        if succeeded(result):
+                            return result
+                    except retry_on as e:
+                        last = e
+                    try:
+                        sleep(next(waits))
+                    except StopIteration as stop:
+                        give_up(f, stop.value, last)
+        return trier
+    return wrapper
+
+print('full:         ', ['{:.2f}'.format(d) for d in islice(_delays(0.1, 2, 10, 'full'), 6)])
+print('decorrelated: ', ['{:.2f}'.format(d) for d in islice(_delays(0.1, 2, 10, 'decorrelated'), 6)])
+print('none:         ', ['{:.2f}'.format(d) for d in islice(_delays(0.1, 2, 10, None), 6)])
+
+flaky_calls = []
+
+@backoff_retry(times=5, delay=0.01, retry_on=(ConnectionError,))
+async def flaky():
+    flaky_calls.append(time.monotonic())
+    if len(flaky_calls) < 3:
+        raise ConnectionError('nope')
+    return 'finally'
+
+async def ticker():
+    '''Proves the loop isn't blocked while flaky backs off.'''
+    ticks = 0
+    while len(flaky_calls) < 3:
+        ticks += 1
+        await asyncio.sleep(0.001)
+    return ticks
+
+async def main():
+    return await asyncio.gather(flaky(), ticker())
+
+result, ticks = asyncio.run(main())
+print('{!r} after {} attempts, ticker ran {} times in the meantime'.format(result, len(flaky_calls), ticks))
+
+@backoff_retry(times=10, delay=0.2, jitter=None, deadline=0.5, retry_on=(ConnectionError,), exc=TimeoutError)
+def hopeless():
+    raise ConnectionError('still nope')
+
+started = time.monotonic()
+try:
+    hopeless()
+except TimeoutError as e:
+    print(e, 'after {:.1f}s because {!r}'.format(time.monotonic() - started, e.__cause__))
+
+
+# Out[22]:
+
+#     full:          ['0.09', '0.12', '0.08', '0.75', '0.47', '2.42']
+#     decorrelated:  ['0.26', '0.20', '0.49', '0.94', '2.80', '6.12']
+#     none:          ['0.10', '0.20', '0.40', '0.80', '1.60', '3.20']
+#     'finally' after 3 attempts, ticker ran 16 times in the meantime
+#     Attempted <function hopeless at 0x7f748d7516c0> 2 times, failed to return result after 0.2s because ConnectionError('still nope')
+# 
+
+# `hopeless` gave up after two attempts rather than ten: the third sleep would have blown through the half second budget, so it didn't bother. And the ticker kept ticking the whole time `flaky` was backing off, which is the entire point of not calling `time.sleep` in a coroutine.
+
+# Hooks That Don't Hold You Up
+# ----------------------------
+# `register_hooks` even says it in its docstring: realistically, you'd do this in an async way. As it is, every watcher runs on the caller's thread after every call, so a slow watcher makes the function it's watching slow too, and the caller doesn't even care what the watchers do.
+# 
+# So instead of running the hooks, the wrapper drops `(f, result)` into a queue and gets back to work. Something else drains the queue and delivers to the hooks, in batches: everything that's piled up since the last delivery, up to `batch` at a time. A hook with a `run_batch(f, results)` method gets the whole batch in one call, and anything with just `run` gets called once per result like before.
+# 
+# The queue is bounded (`maxsize`), because a watcher that can't keep up shouldn't be able to eat all the memory. What happens when it's full is the `policy`:
+# 
+# * `'drop_new'` -- the newest result is thrown away. The caller never waits.
+# * `'drop_old'` -- the oldest queued result is thrown away to make room. Also never waits, and the hooks see the most recent results.
+# * `'block'` -- backpressure: the caller waits for room. Nothing's lost, but slow hooks are back to slowing down the function (only once the queue is full, though).
+# 
+# The "something else" is either a worker thread (`HookDispatcher`) or an asyncio task (`AsyncHookDispatcher`, which can't block the loop, so no `'block'` for it). Dropped results and errors raised by hooks are counted rather than raised -- a broken watcher shouldn't take down the dispatcher. `close()` (awaited, for the asyncio one) delivers whatever's still queued and stops the worker; anything submitted after that is counted as dropped, since there's nobody left to deliver it.
+
+# In[23]:
+
+from collections import deque
+from threading import Condition, Thread
+
+class _Dispatcher(object):
+    policies = ('drop_new', 'drop_old', 'block')
+
+    def __init__(self, maxsize=1024, batch=64, policy='drop_new'):
+        if policy not in self.policies:
+            raise ValueError('Unknown policy {!r}'.format(policy))
+        self.queue = deque()
+        self.maxsize = maxsize
+        self.batch = batch
+        self.policy = policy
+        self.closed = False
+        self.delivered = self.dropped = self.errors = 0
+
+    def _enqueue(self, item):
+        '''Queue item, making room according to the drop policy.'''
+        if self.closed:
+            # nothing's going to deliver it
+            self.dropped += 1
+            return
+        if len(self.queue) >= self.maxsize:
+            self.dropped += 1
+            if self.policy == 'drop_new':
+                return
+            self.queue.popleft()
+        self.queue.append(item)
+
+    def _take(self):
+        return [self.queue.popleft() for _ in range(min(self.batch, len(self.queue)))]
+
+    def _deliver(self, batch):
+        by_func = OrderedDict()
+        for f, res in batch:
+            by_func.setdefault(f, []).append(res)
+        for f, results in by_func.items():
+            for h in f.__watchers__:
+                try:
+                    if hasattr(h, 'run_batch'):
+                        h.run_batch(f, results)
+                    else:
+                        for res in results:
+                            h.run(f, res)
+                except Exception:
+                    self.errors += 1
+        self.delivered += len(batch)
+
+class HookDispatcher(_Dispatcher):
+    '''Delivers results to hooks in batches from a worker thread.'''
+    def __init__(self, maxsize=1024, batch=64, policy='drop_new'):
+        super().__init__(maxsize, batch, policy)
+        self.cond = Condition()
+        self.inflight = 0
+        self.worker = Thread(target=self._run, daemon=True)
+        self.worker.start()
+
+    def submit(self, f, res):
+        with self.cond:
+            if self.policy == 'block':
+                while len(self.queue) >= self.maxsize and not self.closed:
+                    self.cond.wait()
+            self._enqueue((f, res))
+            self.cond.notify_all()
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self.queue and not self.closed:
+                    self.cond.wait()
+                if not self.queue:
+                    return
+                batch = self._take()
+                self.inflight = len(batch)
+                self.cond.notify_all()
+            self._deliver(batch)
+            with self.cond:
+                self.inflight = 0
+                self.cond.notify_all()
+
+    def flush(self):
+        '''Wait until everything submitted so far has been delivered.'''
+        with self.cond:
+            while self.queue or self.inflight:
+                self.cond.wait()
+
+    def close(self):
+        '''Deliver what's queued, then stop the worker.'''
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+        self.worker.join()
+
+class AsyncHookDispatcher(_Dispatcher):
+    '''Delivers results to hooks in batches from an asyncio task.
+    submit has to be called from the event loop's thread.
+    '''
+    policies = ('drop_new', 'drop_old')
+
+    def __init__(self, maxsize=1024, batch=64, policy='drop_new'):
+        super().__init__(maxsize, batch, policy)
+        self.wakeup = None
+        self.task = None
+
+    def submit(self, f, res):
+        if self.closed:
+            self.dropped += 1
+            return
+        if self.task is None:
+            self.wakeup = asyncio.Event()
+            self.task = asyncio.ensure_future(self._run())
+        self._enqueue((f, res))
+        self.wakeup.set()
+
+    async def _run(self):
+        while True:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+            while self.queue:
+                self._deliver(self._take())
+                # let everyone else have a turn between batches
+                await asyncio.sleep(0)
+
+    async def flush(self):
+        while self.queue:
+            await asyncio.sleep(0)
+
+    async def close(self):
+        '''Deliver what's queued, then stop the task.'''
+        self.closed = True
+        if self.task is not None:
+            await self.flush()
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+
+def dispatch_hooks(*hooks, dispatcher):
+    '''register_hooks, but results are handed to dispatcher instead of
+    being delivered to the hooks on the caller's thread.
+    '''
+    def wrapper(f):
+        if not hasattr(f, '__registered__'):
+            for h in hooks:
+                h.register(f)
+            f.__registered__ = True
+            f.__watchers__ = hooks
+
+        submit = dispatcher.submit
+
+        @wraps(f)
+        def run(*args, **kw):
+            res = f(*args, **kw)
+            submit(f, res)
+            return res
+
+        return run
+    return wrapper
+
+class slow_hook(hook):
+    '''Takes its time with every result, and counts batches.'''
+    def __init__(self, name):
+        super().__init__(name)
+        self.batches = []
+
+    def register(self, f):
+        pass
+
+    def run(self, f, res):
+        sleep(0.001)
+
+    def run_batch(self, f, results):
+        sleep(0.001)
+        self.batches.append(len(results))
+
+dispatcher = HookDispatcher(maxsize=10000, batch=500)
+
+@register_hooks(slow_hook('sync'))
+def sync_double(x):
+    return x*2
+
+watcher = slow_hook('threaded')
+
+@dispatch_hooks(watcher, dispatcher=dispatcher)
+def threaded_double(x):
+    return x*2
+
+get_ipython().magic('timeit -n 100 -r 5 sync_double(4)')
+get_ipython().magic('timeit -n 100 -r 5 threaded_double(4)')
+dispatcher.flush()
+print('delivered {} results in {} batches, dropped {}'.format(dispatcher.delivered, len(watcher.batches), dispatcher.dropped))
+dispatcher.close()
+
+async def main():
+    dispatcher = AsyncHookDispatcher(maxsize=500, batch=100, policy='drop_old')
+    watcher = slow_hook('async')
+
+    @dispatch_hooks(watcher, dispatcher=dispatcher)
+    def triple(x):
+        return x*3
+
+    for i in range(1000):
+        triple(i)
+    await dispatcher.close()
+    print('delivered {} results in batches of {}, dropped {}'.format(dispatcher.delivered, watcher.batches, dispatcher.dropped))
+
+asyncio.run(main())
+
+
+# Out[23]:
+
+#     100 loops, best of 5: 1.09 ms per loop
+#     100 loops, best of 5: 1.68 µs per loop
+#     delivered 500 results in 1 batches, dropped 0
+#     delivered 500 results in batches of [100, 100, 100, 100, 100], dropped 500
+# 
+
+# The hook's millisecond is gone from the call itself: `threaded_double` costs about what a queue append costs. The worker didn't get a look in until `flush` (one core, and the caller was busy), by which point all 500 results were waiting, and they went to the hook in a single `run_batch` call -- one sleep instead of 500.
+# 
+# The asyncio one pushed 1000 results into a queue of 500 with `'drop_old'`, so the first 500 were dropped and the last 500 were delivered, 100 at a time.
+
+# Counting Instead of Printing
+# ----------------------------
+# `loggit` was the first decorator we built and it's the one you'd least want on a hot function: a `print` per call is a write to stdout per call. What you usually want from "logging" a function isn't a line per call anyway, it's numbers: how often is it called, how long does it take (not on average -- the 99th percentile is what people notice), and how often does it blow up.
+# 
+# So `instrument` keeps numbers. Every call bumps a few integers in a flat list:
+# 
+# * the call count, the total time in nanoseconds and the exception count
+# * a histogram of latencies, HDR style: bucketed by power of two, and each power of two split into 8 linear sub-buckets. That's under 500 buckets to cover anything from 1ns to centuries, and any value read back out is within 12.5% of the real one. Finding the bucket is a `bit_length` and a shift, no searching.
+# 
+# Each thread gets its own list (via `threading.local`), so nothing on the hot path takes a lock or touches another thread's counters -- the only lock is taken the first time a thread calls a function, to add its list to that function's pile. Nothing is added up until you ask: `snapshot()` folds every thread's list together and reads percentiles out of the merged histogram, and `prometheus()` writes the same thing out in Prometheus's text format.
+# 
+# "Nanoseconds per call" is as much as you get in Python -- the extra function call and `try`/`finally` of any decorator is already a good chunk of that. But `perf_counter_ns` doesn't make a syscall on Linux, and none of this waits on IO.
+
+# In[24]:
+
+from threading import local
+from time import perf_counter_ns
+
+_CALLS, _TOTAL, _ERRORS, _HIST = 0, 1, 2, 3
+_SUB_BITS = 3
+# enough for any nanosecond count that fits in 64 bits
+_BUCKETS = (65 - _SUB_BITS) << _SUB_BITS
+
+Snapshot = namedtuple('Snapshot', 'name calls errors total mean percentiles max')
+
+def _bucket_floor(i):
+    '''Smallest nanosecond value that lands in bucket i.'''
+    if i < 2 << _SUB_BITS:
+        return i
+    shift = (i >> _SUB_BITS) - 1
+    return (i - (shift << _SUB_BITS)) << shift
+
+class _Metric(object):
+    def __init__(self, name):
+        self.name = name
+        self.local = local()
+        self.lock = Lock()
+        self.threads = []
+
+    def counts(self):
+        '''This thread's counters, created on first use.'''
+        c = self.local.c = [0] * (_HIST + _BUCKETS)
+        with self.lock:
+            self.threads.append(c)
+        return c
+
+    def snapshot(self, quantiles=(0.5, 0.9, 0.99, 0.999)):
+        with self.lock:
+            # other threads keep writing while we add up, so this can be a
+            # call or two behind, but that's the price of not locking them
+            merged = [sum(col) for col in zip(*self.threads)] or [0] * (_HIST + _BUCKETS)
+        calls, total, errors, hist = merged[_CALLS], merged[_TOTAL], merged[_ERRORS], merged[_HIST:]
+        percentiles, seen, top = OrderedDict(), 0, 0
+        wanted = iter(quantiles)
+        q = next(wanted, None)
+        for i, n in enumerate(hist):
+            if not n:
+                continue
+            seen += n
+            top = _bucket_floor(i + 1) - 1
+            while q is not None and seen >= q * calls:
+                percentiles[q] = top
+                q = next(wanted, None)
+        return Snapshot(self.name, calls, errors, total, total / calls if calls else 0, percentiles, top)
+
+metrics = OrderedDict()
+
+def instrument(f):
+    '''Records call counts, latencies and exceptions for f.'''
+    name = '{}.{}'.format(f.__module__, f.__qualname__)
+    metric = metrics[name] = _Metric(name)
+    counters = metric.local
+    clock = perf_counter_ns
+
+    @wraps(f)
+    def instrumented(*args, **kw):
+        try:
+            c = counters.c
+        except AttributeError:
+            c = metric.counts()
+        start = clock()
+        try:
+            return f(*args, **kw)
+        except Exception:
+            c[_ERRORS] += 1
+            raise
+        finally:
+            ns = clock() - start
+            c[_CALLS] += 1
+            c[_TOTAL] += ns
+            b = ns.bit_length()
+            if b > _SUB_BITS + 1:
+                ns = ((b - _SUB_BITS - 1) << _SUB_BITS) + (ns >> (b - _SUB_BITS - 1))
+            c[_HIST + ns] += 1
+
+    instrumented.snapshot = metric.snapshot
+    return instrumented
+
+def snapshot():
+    '''Snapshots of every instrumented function.'''
+    return [m.snapshot() for m in metrics.values()]
+
+def prometheus():
+    '''Every instrumented function in Prometheus's text exposition format.'''
+    lines = ['# TYPE function_seconds summary']
+    errors = ['# TYPE function_errors_total counter']
+    for s in snapshot():
+        label = 'function="{}"'.format(s.name)
+        for q, ns in s.percentiles.items():
+            lines.append('function_seconds{{{},quantile="{}"}} {:.9f}'.format(label, q, ns / 1e9))
+        lines.append('function_seconds_sum{{{}}} {:.9f}'.format(label, s.total / 1e9))
+        lines.append('function_seconds_count{{{}}} {}'.format(label, s.calls))
+        errors.append('function_errors_total{{{}}} {}'.format(label, s.errors))
+    return '\n'.join(lines + errors) + '\n'
+
+def plain_double(x):
+    return 2*x
+
+@instrument
+def double(x):
+    '''Doubles a number.'''
+    return 2*x
+
+@instrument
+def fragile(x):
+    if x % 10 == 0:
+        raise ValueError(x)
+    sleep(x / 100000)
+    return x
+
+get_ipython().magic('timeit plain_double(4)')
+get_ipython().magic('timeit double(4)')
+
+def work():
+    for x in range(1, 100):
+        try:
+            fragile(x)
+        except ValueError:
+            pass
+
+threads = [Thread(target=work) for _ in range(4)]
+for t in threads:
+    t.start()
+for t in threads:
+    t.join()
+
+s = fragile.snapshot()
+print('\n{} calls over {} threads, {} errors, mean {:.0f}µs, max {:.0f}µs'.format(
+      s.calls, len(metrics[s.name].threads), s.errors, s.mean / 1e3, s.max / 1e3))
+print('p50 {:.0f}µs, p99 {:.0f}µs\n'.format(s.percentiles[0.5] / 1e3, s.percentiles[0.99] / 1e3))
+print(prometheus())
+
+
+# Out[24]:
+
+#     1000 loops, best of 3: 70.4 ns per loop
+#     1000 loops, best of 3: 1.37 µs per loop
+#     
+#     396 calls over 4 threads, 36 errors, mean 525µs, max 1442µs
+#     p50 524µs, p99 1180µs
+#     
+#     # TYPE function_seconds summary
+#     function_seconds{function="__main__.double",quantile="0.5"} 0.000000383
+#     function_seconds{function="__main__.double",quantile="0.9"} 0.000000383
+#     function_seconds{function="__main__.double",quantile="0.99"} 0.000000447
+#     function_seconds{function="__main__.double",quantile="0.999"} 0.000000767
+#     function_seconds_sum{function="__main__.double"} 0.001043622
+#     function_seconds_count{function="__main__.double"} 3000
+#     function_seconds{function="__main__.fragile",quantile="0.5"} 0.000524287
+#     function_seconds{function="__main__.fragile",quantile="0.9"} 0.000983039
+#     function_seconds{function="__main__.fragile",quantile="0.99"} 0.001179647
+#     function_seconds{function="__main__.fragile",quantile="0.999"} 0.001441791
+#     function_seconds_sum{function="__main__.fragile"} 0.207831770
+#     function_seconds_count{function="__main__.fragile"} 396
+#     # TYPE function_errors_total counter
+#     function_errors_total{function="__main__.double"} 0
+#     function_errors_total{function="__main__.fragile"} 36
+# 
+
+# On this machine that's about 1.3µs on top of a bare call, most of it the wrapper call and two trips to the clock -- about what `loggit` costs with its prints going to `/dev/null`, and a lot less than it costs when they go to a terminal. In return you get the percentiles: `double` itself takes around 400ns with the clock calls included, and `fragile`, sleeping anywhere from 10µs to a millisecond, has a median right about in the middle and a p99 at the top of its range, all four threads' calls counted without any of them waiting on each other.
+
+# Locks With Less Waiting
+# -----------------------
+# Way back at `synchronize` I said threading wasn't my strong suit, and the original proved it: it threw away whatever the function returned (that's been fixed up there, it's a `return` away). The bigger problem is that everything decorated with it queues up behind one lock, so however many threads you throw at it, one of them is doing work at a time. Two ways out, depending on why you needed the lock:
+# 
+# **Most callers only read.** A reader-writer lock lets any number of readers in together, and a writer waits until it can have the thing to itself. `RWLock` hands out a `reader` and a `writer`, both ordinary context managers, so they slot straight into `synchronize` -- no new decorator needed. Once a writer is waiting, new readers queue up behind it, otherwise a steady trickle of readers would keep writers out forever.
+# 
+# **Callers touch different things.** If `update(account, amount)` only ever needs to be exclusive per account, one lock for every account is waste. `StripedLock` is a fixed set of locks picked by hashing a key -- and `striped(locks, 'account')` pulls the key out of the call, by position or by name. Calls on different keys only wait on each other when their keys land on the same stripe, which with 64 stripes isn't often. A lock per key would avoid even that, but then you need to clean them up, and this never grows.
+# 
+# Since the functions below sleep, and sleeping lets go of the GIL, the threads really do get to overlap where the locks let them.
+
+# In[25]:
+
+class _held(object):
+    '''Reusable context manager out of an acquire/release pair.'''
+    __slots__ = ('acquire', 'release')
+
+    def __init__(self, acquire, release):
+        self.acquire = acquire
+        self.release = release
+
+    def __enter__(self):
+        self.acquire()
+
+    def __exit__(self, *exc):
+        self.release()
+
+class RWLock(object):
+    '''Many readers or one writer. Waiting writers go ahead of new readers.'''
+    def __init__(self):
+        self.cond = Condition(Lock())
+        self.readers = 0
+        self.writing = False
+        self.waiting_writers = 0
+        self.reader = _held(self.acquire_read, self.release_read)
+        self.writer = _held(self.acquire_write, self.release_write)
+
+    def acquire_read(self):
+        with self.cond:
+            while self.writing or self.waiting_writers:
+                self.cond.wait()
+            self.readers += 1
+
+    def release_read(self):
+        with self.cond:
+            self.readers -= 1
+            if not self.readers:
+                self.cond.notify_all()
+
+    def acquire_write(self):
+        with self.cond:
+            self.waiting_writers += 1
+            while self.writing or self.readers:
+                self.cond.wait()
+            self.waiting_writers -= 1
+            self.writing = True
+
+    def release_write(self):
+        with self.cond:
+            self.writing = False
+            self.cond.notify_all()
+
+class StripedLock(object):
+    '''A fixed number of locks, one picked per key.'''
+    def __init__(self, stripes=64, factory=Lock):
+        self.locks = [factory() for _ in range(stripes)]
+
+    def __getitem__(self, key):
+        return self.locks[hash(key) % len(self.locks)]
+
+def synchronize(lock):
+    '''Synchronize multiple functions on a single lock (or anything usable with `with`).'''
+    def wrapper(f):
+        @wraps(f)
+        def locker(*args, **kw):
+            with lock:
+                return f(*args, **kw)
+        return locker
+    return wrapper
+
+def striped(locks, key=0):
+    '''Lock on locks[argument], key being the argument's position or name.'''
+    def wrapper(f):
+        # the same argument can arrive by position or by name, so know both
+        params = inspect.signature(f).parameters
+        names = list(params)
+        if isinstance(key, str):
+            name, index = key, names.index(key) if key in params else None
+        else:
+            name, index = names[key] if key < len(names) else None, key
+        default = None
+        if name in params and params[name].default is not params[name].empty:
+            default = params[name].default
+
+        @wraps(f)
+        def locker(*args, **kw):
+            if index is not None and index < len(args):
+                k = args[index]
+            else:
+                k = kw.get(name, default)
+            with locks[k]:
+                return f(*args, **kw)
+        return locker
+    return wrapper
+
+def hammer(f, args, threads=8, times=5):
+    '''Seconds for threads threads to each call f(*args[i]) times times.'''
+    def work(i):
+        for _ in range(times):
+            f(*args[i])
+    ts = [Thread(target=work, args=(i,)) for i in range(threads)]
+    start = time.perf_counter()
+    for t in ts:
+        t.start()
+    for t in ts:
+        t.join()
+    return time.perf_counter() - start
+
+balances = defaultdict(int)
+one_lock = Lock()
+accounts = StripedLock()
+rw = RWLock()
+
+@synchronize(one_lock)
+def update_global(account, amount):
+    sleep(0.01)
+    balances[account] += amount
+    return balances[account]
+
+@striped(accounts, 'account')
+def update_striped(account, amount):
+    sleep(0.01)
+    balances[account] += amount
+    return balances[account]
+
+@synchronize(one_lock)
+def read_global(account):
+    sleep(0.01)
+    return balances[account]
+
+@synchronize(rw.reader)
+def read_shared(account):
+    sleep(0.01)
+    return balances[account]
+
+@synchronize(rw.writer)
+def write_exclusive(account, amount):
+    sleep(0.01)
+    balances[account] += amount
+
+by_account = [('account-{}'.format(i), 1) for i in range(8)]
+print('update, one lock:  {:.2f}s'.format(hammer(update_global, by_account)))
+print('update, striped:   {:.2f}s'.format(hammer(update_striped, by_account)))
+print('read, one lock:    {:.2f}s'.format(hammer(read_global, [(a,) for a, _ in by_account])))
+print('read, shared:      {:.2f}s'.format(hammer(read_shared, [(a,) for a, _ in by_account])))
+write_exclusive('account-0', 100)
+print('update_striped returned {!r}'.format(update_striped(account='account-0', amount=5)))
+
+
+# Out[25]:
+
+#     update, one lock:  0.42s
+#     update, striped:   0.05s
+#     read, one lock:    0.41s
+#     read, shared:      0.05s
+#     update_striped returned 115
+# 
+
+# Forty sleeps of 10ms each: one after another behind the single lock, or five rounds of eight at once when the locks stay out of the way. `account-0` ended up at 115 -- five from each of the two update runs, the writer's 100, and the last 5 -- and that number came back out of the decorated function this time.
+
+# Flattening the Stack
+# --------------------
+# Back with the stacked `fib`, the problem was that `repr` came out wrong. The other problem is the price: every layer is another call, another round of packing everything into `*args, **kw` and unpacking it again, and the class based ones look up `self.f` on top of that. Hooks, a cache, a lock and some timing is four trips through that for one function call.
+# 
+# None of those layers need to be separate functions, though. `fuse` takes the behaviours as options and writes *one* function that does all of them, in the order you'd want if you stacked them: timing around everything, then the cache, the lock only around the real call, and hooks getting every result on the way out. It writes it as source code, the way `namedtuple` writes its classes, so that the wrapper has exactly the same parameters as the function it wraps -- `def fib(n)` gets a wrapper that's `def _fused(n)`, renamed to `fib` by `wraps` afterwards (the generated name is fixed so lambdas and functions called `_f` work too), so there's nothing to pack, the cache key is just `n`, and `inspect.signature` (and `help`) tells the truth without needing `__wrapped__`. Defaults are copied over afterwards rather than written into the source, so they don't need a usable `repr`.
+# 
+# The options:
+# 
+# * `cache` -- `True` for a fresh dict, or any mapping you want to supply. Arguments have to be hashable, same as with `lru_cache`.
+# * `hooks` -- registered the same way `register_hooks` does, and run with every result, cached or not.
+# * `lock` -- anything that works with `with`, so the `RWLock` handles and `StripedLock` stripes from before work too.
+# * `timed` -- records into the same `metrics` as `instrument`, so `snapshot()` and `prometheus()` pick it up.
+# 
+# The generated source is kept on the wrapper as `__source__`, because generated code you can't read is no fun to debug.
+
+# In[26]:
+
+_fused_names = ('_f', '_cache', '_hooks', '_lock', '_counters', '_metric', '_clock', '_key', '_res', '_start', '_ns', '_b', '_c', '_h')
+
+def _signature_source(f):
+    '''Parameter list, call arguments and cache key for f, as source.'''
+    params, call, key = [], [], []
+    positional_only = keyword_only = False
+    for p in inspect.signature(f).parameters.values():
+        if p.name in _fused_names:
+            raise ValueError("Can't fuse {!r}, parameter {!r} is taken".format(f, p.name))
+        if positional_only and p.kind is not p.POSITIONAL_ONLY:
+            params.append('/')
+            positional_only = False
+        name = p.name if p.default is p.empty else '{}=None'.format(p.name)
+        if p.kind is p.POSITIONAL_ONLY:
+            positional_only = True
+            params.append(name)
+            call.append(p.name)
+        elif p.kind is p.POSITIONAL_OR_KEYWORD:
+            params.append(name)
+            call.append(p.name)
+        elif p.kind is p.VAR_POSITIONAL:
+            keyword_only = True
+            params.append('*' + p.name)
+            call.append('*' + p.name)
+        elif p.kind is p.KEYWORD_ONLY:
+            if not keyword_only:
+                params.append('*')
+                keyword_only = True
+            params.append(name)
+            call.append('{0}={0}'.format(p.name))
+        else:
+            params.append('**' + p.name)
+            call.append('**' + p.name)
+            key.append('frozenset({}.items())'.format(p.name))
+            continue
+        key.append(p.name)
+    if positional_only:
+        params.append('/')
+    key = key[0] if len(key) == 1 and '(' not in key[0] else '({},)'.format(', '.join(key)) if key else '()'
+    return ', '.join(params), ', '.join(call), key
+
+def fuse(cache=False, hooks=(), lock=None, timed=False):
+    '''Generate a single wrapper doing the work of several stacked decorators.'''
+    def wrapper(f):
+        params, call, key = _signature_source(f)
+        ns = {'_f': f, '_hooks': hooks, '_lock': lock}
+        inner = ['_res = _f({})'.format(call)]
+        if lock is not None:
+            inner = ['with _lock:', inner]
+        if cache is not False:
+            ns['_cache'] = {} if cache is True else cache
+            body = ['_key = ' + key,
+                    'try:', ['_res = _cache[_key]'],
+                    'except KeyError:', inner + ['_cache[_key] = _res']]
+        else:
+            body = inner
+        if hooks:
+            body += ['for _h in _hooks:', ['_h.run(_f, _res)']]
+        body += ['return _res']
+        if timed:
+            name = '{}.{}'.format(f.__module__, f.__qualname__)
+            ns['_metric'] = metrics[name] = _Metric(name)
+            ns['_counters'] = ns['_metric'].local
+            ns['_clock'] = perf_counter_ns
+            body = ['try:', ['_c = _counters.c'],
+                    'except AttributeError:', ['_c = _metric.counts()'],
+                    '_start = _clock()',
+                    'try:', body,
+                    'except Exception:', ['_c[{}] += 1'.format(_ERRORS), 'raise'],
+                    'finally:', ['_ns = _clock() - _start',
+                                 '_c[{}] += 1'.format(_CALLS),
+                                 '_c[{}] += _ns'.format(_TOTAL),
+                                 '_b = _ns.bit_length()',
+                                 'if _b > {}:'.format(_SUB_BITS + 1),
+                                 ['_ns = ((_b - {0}) << {1}) + (_ns >> (_b - {0}))'.format(_SUB_BITS + 1, _SUB_BITS)],
+                                 '_c[{} + _ns] += 1'.format(_HIST)]]
+        source = '\n'.join(_indent(['def _fused({}):'.format(params), body])) + '\n'
+        exec(source, ns)
+        fused = wraps(f)(ns['_fused'])
+        fused.__defaults__ = f.__defaults__
+        fused.__kwdefaults__ = f.__kwdefaults__
+        fused.__source__ = source
+        if cache is not False:
+            fused.cache = ns['_cache']
+        if timed:
+            fused.snapshot = ns['_metric'].snapshot
+        if hooks and not hasattr(f, '__registered__'):
+            for h in hooks:
+                h.register(f)
+            f.__registered__ = True
+            f.__watchers__ = hooks
+        return fused
+    return wrapper
+
+def _indent(lines, depth=0):
+    '''Flatten nested lists of lines, a level of nesting being four spaces.'''
+    for line in lines:
+        if isinstance(line, list):
+            yield from _indent(line, depth + 1)
+        else:
+            yield '    ' * depth + line
+
+class quiet_hook(hook):
+    def __init__(self, name):
+        super().__init__(name)
+        self.seen = 0
+
+    def register(self, f):
+        pass
+
+    def run(self, f, res):
+        self.seen += 1
+
+@instrument
+@register_hooks(quiet_hook('stacked'))
+@memoize
+@synchronize(Lock())
+def stacked_fib(n):
+    return next(islice(_fib(), n, None))
+
+@fuse(cache=True, hooks=(quiet_hook('fused'),), lock=Lock(), timed=True)
+def fused_fib(n):
+    return next(islice(_fib(), n, None))
+
+@fuse(cache=True)
+def scale(x, factor=2, *, offset=0):
+    '''Multiplies and shifts.'''
+    return x*factor + offset
+
+print(fused_fib.__source__)
+for f in (stacked_fib, fused_fib, scale):
+    print(f.__name__, inspect.signature(f, follow_wrapped=False))
+print(scale(3), scale(3, offset=1), scale.cache)
+print()
+stacked_fib(50)
+fused_fib(50)
+get_ipython().magic('timeit stacked_fib(50)')
+get_ipython().magic('timeit fused_fib(50)')
+
+
+# Out[26]:
+
+#     def _fused(n):
+#         try:
+#             _c = _counters.c
+#         except AttributeError:
+#             _c = _metric.counts()
+#         _start = _clock()
+#         try:
+#             _key = n
+#             try:
+#                 _res = _cache[_key]
+#             except KeyError:
+#                 with _lock:
+#                     _res = _f(n)
+#                 _cache[_key] = _res
+#             for _h in _hooks:
+#                 _h.run(_f, _res)
+#             return _res
+#         except Exception:
+#             _c[2] += 1
+#             raise
+#         finally:
+#             _ns = _clock() - _start
+#             _c[0] += 1
+#             _c[1] += _ns
+#             _b = _ns.bit_length()
+#             if _b > 4:
+#                 _ns = ((_b - 4) << 3) + (_ns >> (_b - 4))
+#             _c[3 + _ns] += 1
+#     
+#     stacked_fib (*args, **kw)
+#     fused_fib (n)
+#     scale (x, factor=2, *, offset=0)
+#     6 7 {(3, 2, 0): 6, (3, 2, 1): 7}
+#     
+#     Caching args ((50,){}) and result now.
+#     1000 loops, best of 3: 2.31 µs per loop
+#     1000 loops, best of 3: 694 ns per loop
+# 
+
+# Same cache, same hook, same lock, same timing, about a third of the time per call -- and some of the stacked version's cost is `memoize` building its string key, which the fused one doesn't need since `n` is already hashable. Only `scale` needed a tuple for its key, and it got its default `factor` and keyword only `offset` for free.
+# 
+# The catch is that you get the behaviours `fuse` knows about and no others. Anything that doesn't wrap the call, like `annotate`, stacks on top of it just fine.
+
+# Interning Without Hoarding
+# --------------------------
+# `Memoize` on `Point` is really interning: ask for `Point(3, 4)` twice and you get the same object back, which is handy when there are millions of points but only a few thousand different ones. It's got the same problems the function caches had, though. The key is a `repr` string, and nothing ever leaves the cache unless you go in and `del` the whole class's worth. And because it swaps the class out for a function, `isinstance(p, Point)` stops working.
+# 
+# `Interner` does the same job as a class decorator that hands back a class. It rebuilds the class with a metaclass whose `__call__` -- what runs when you call `Point(3, 4)` -- checks a pool before making anything new:
+# 
+# * The key is the constructor arguments. Plain positional calls (the common case) are used as they are; anything with keywords or missing defaults is bound to the signature first, so `Point(3, 4)` and `Point(y=4, x=3)` are the same point. The types go into the key too, otherwise `Point(1, 2)` and `Point(1.0, 2)` would hash the same and you'd get back whichever came first. Arguments that can't be hashed just get a fresh, uninterned instance.
+# * The pool only holds weak references, so it only keeps what's in use somewhere else. Once the last outside reference to a point goes, a callback on the reference takes its entry out too -- the pool is bounded by what you're actually using, with nothing to prune.
+# * `Interner(slots=True)` also gives the class `__slots__`, named after its `__init__` parameters (plus `__weakref__`, which the pool needs). A class attribute with the same name as one of them would get in the way of its slot, so that's refused up front. Interning cuts down the number of objects, slots cut down the size of each one.
+# * `info()` reports hits, misses, how many instances are alive and the hit ratio, per class. Every class gets its own pool and counters when it's made, subclasses included, so a subclass of `Point` never hands back a `Point`.
+# 
+# Handing the same instance to everyone who asks for a particular point only works if nobody changes it, so this is for value classes that you treat as immutable.
+
+# In[27]:
+
+import tracemalloc
+
+InternInfo = namedtuple('InternInfo', 'hits misses live hit_ratio')
+
+def _forget(pool, key, ref):
+    # only if it hasn't been replaced by a newer instance in the meantime
+    if pool.get(key) is ref:
+        del pool[key]
+
+class _interning(type):
+    '''Metaclass that hands out existing instances for repeated arguments.'''
+    def __init__(cls, name, bases, namespace):
+        super().__init__(name, bases, namespace)
+        params = list(inspect.signature(cls.__init__).parameters.values())[1:]
+        if any(p.kind in (p.VAR_POSITIONAL, p.VAR_KEYWORD, p.KEYWORD_ONLY) for p in params):
+            raise TypeError("Can't intern {!r}, it needs a fixed set of positional arguments".format(cls))
+        # set on every class, subclasses included, so none of them share a pool
+        cls.__pool__ = {}
+        cls.__hits__ = cls.__misses__ = 0
+        cls.__arity__ = len(params)
+        cls.__signature__ = inspect.Signature(params)
+
+    def __call__(cls, *args, **kw):
+        if kw or len(args) != cls.__arity__:
+            bound = cls.__signature__.bind(*args, **kw)
+            bound.apply_defaults()
+            args = tuple(bound.arguments.values())
+        pool = cls.__pool__
+        try:
+            key = args + tuple(map(type, args))
+            obj = pool[key]()
+        except TypeError:
+            return super().__call__(*args)
+        except KeyError:
+            obj = None
+        if obj is None:
+            cls.__misses__ += 1
+            obj = super().__call__(*args)
+            pool[key] = weakref.ref(obj, partial(_forget, pool, key))
+        else:
+            cls.__hits__ += 1
+        return obj
+
+def _rebind_class(f, old, new):
+    '''Point a function's __class__ cell (what zero argument super uses) at new.'''
+    try:
+        i = f.__code__.co_freevars.index('__class__')
+    except (AttributeError, ValueError):
+        return
+    cell = f.__closure__[i]
+    if cell.cell_contents is old:
+        cell.cell_contents = new
+
+class Interner(object):
+    def __init__(self, slots=False):
+        self.slots = slots
+        self.classes = OrderedDict()
+
+    def __call__(self, cls):
+        namespace = dict(cls.__dict__)
+        namespace.pop('__dict__', None)
+        namespace.pop('__weakref__', None)
+        if self.slots:
+            params = list(inspect.signature(cls.__init__).parameters)[1:]
+            clashes = [p for p in params if p in namespace]
+            if clashes:
+                raise TypeError("Can't give {!r} slots, {} would clash with its class attributes".format(
+                                cls, ', '.join(clashes)))
+            # a base class might already have made it weakrefable
+            weak = () if any(hasattr(b, '__weakref__') for b in cls.__bases__) else ('__weakref__',)
+            namespace['__slots__'] = tuple(params) + weak
+        interned = _interning(cls.__name__, cls.__bases__, namespace)
+        interned.__qualname__ = cls.__qualname__
+        # the methods still think they belong to cls, which breaks super();
+        # the same fix dataclass(slots=True) makes when it rebuilds a class
+        for member in namespace.values():
+            member = inspect.unwrap(member)
+            if isinstance(member, property):
+                for f in (member.fget, member.fset, member.fdel):
+                    _rebind_class(f, cls, interned)
+            else:
+                _rebind_class(member, cls, interned)
+        self.classes[cls.__name__] = interned
+        return interned
+
+    def info(self):
+        stats = OrderedDict()
+        for name, cls in self.classes.items():
+            calls = cls.__hits__ + cls.__misses__
+            stats[name] = InternInfo(cls.__hits__, cls.__misses__, len(cls.__pool__),
+                                     cls.__hits__ / calls if calls else 0.0)
+        return stats
+
+class Point(object):
+    '''Represents a point in Euclidean space.'''
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+
+    def __add__(self, other):
+        return type(self)(self.x+other.x, self.y+other.y)
+
+PlainPoint = Point
+interned = Interner(slots=True)
+Point = interned(Point)
+
+_34 = Point(3, 4)
+assert _34 is Point(3, 4) is Point(y=4, x=3)
+assert Point(1, 2) is not Point(1.0, 2)
+assert isinstance(_34 + _34, Point) and (_34 + _34).x == 6
+
+class LabelledPoint(Point):
+    __slots__ = ()
+
+assert type(LabelledPoint(3, 4)) is LabelledPoint and LabelledPoint(3, 4) is not _34
+print(Point.__name__, ': ', Point.__doc__, Point.__slots__)
+print(interned.info())
+
+def measure(cls, n=200000):
+    '''Memory held by n points from a 100x10 grid.'''
+    tracemalloc.start()
+    points = [cls(i % 100, i // 100 % 10) for i in range(n)]
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return points, size
+
+for label, cls in (('plain', PlainPoint), ('interned', Point)):
+    points, size = measure(cls)
+    print('{:<9} {:>6} distinct, {:>5.2f}MB'.format(label, len(set(map(id, points))), size / 2**20))
+
+print(interned.info()['Point'])
+get_ipython().magic('timeit PlainPoint(3, 4)')
+get_ipython().magic('timeit Point(3, 4)')
+del points, _34
+print('after del:', interned.info()['Point'].live, 'alive')
+
+
+# Out[27]:
+
+#     Point :  Represents a point in Euclidean space. ('x', 'y', '__weakref__')
+#     OrderedDict([('Point', InternInfo(hits=2, misses=5, live=1, hit_ratio=0.2857142857142857))])
+#     plain     200000 distinct, 18.34MB
+#     interned    1000 distinct,  2.08MB
+#     InternInfo(hits=199003, misses=1004, live=1000, hit_ratio=0.9949801756938507)
+#     1000 loops, best of 3: 495 ns per loop
+#     1000 loops, best of 3: 2.04 µs per loop
+#     after del: 0 alive
+# 
+
+# Two hundred thousand points, a thousand different ones: a thousand objects instead of two hundred thousand, and about a ninth of the memory, most of what's left being the list itself. The price is paid on every construction -- a hit goes through the metaclass, builds a key and follows a weak reference, which is a few times slower than just making a small object. It's a trade for memory, not for speed. And once the points were gone, so was every entry in the pool.
+
 # Fin
 # ---
 # 